@@ -1,20 +1,31 @@
 import argparse
-import csv
+import asyncio
+import gzip
 import os
-import sys
+import shutil
+import time
+import warnings
+import zlib
+from contextlib import closing
 from pathlib import Path
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import boto3
+import pandas as pd
+from botocore.config import Config
 from botocore.exceptions import ClientError
 from tqdm import tqdm
 
-csv.field_size_limit(sys.maxsize)
+STREAM_BUFFER_SIZE = 128 * 1024
+PART_SUFFIX = ".part"
 
+AUTO_TUNE_THREADS = [8, 16, 32, 64]
+# IDs per timed batch, so even the largest candidate keeps every thread busy for several tasks
+AUTO_TUNE_SAMPLE = 2 * max(AUTO_TUNE_THREADS)
 
 
 def parse_args():
-    parser = argparse.ArgumentParser(description="Download latest .gz trace files from S3 based on ID list in CSV")
+    parser = argparse.ArgumentParser(description="Download and decompress the latest .gz trace files from S3 based on ID list in CSV")
 
     parser.add_argument("--csv-path", type=str, required=True, default=None,
                         help="Path to CSV file containing IDs")
@@ -26,35 +37,53 @@ def parse_args():
                         help="S3 bucket name")
     parser.add_argument("--region-name", type=str, default="us-west-2",
                         help="AWS region of the S3 bucket")
-    parser.add_argument("--max-threads", type=int, default=30,
+    # More threads is not always faster: past a point GIL and connection contention reduce throughput
+    parser.add_argument("--max-threads", type=int, default=16,
                         help="Maximum number of parallel download threads")
+    parser.add_argument("--max-pool-connections", type=int, default=None,
+                        help="Size of the shared S3 connection pool (default: --max-threads)")
+    parser.add_argument("--auto-tune", action="store_true",
+                        help="Time a batch of new downloads at each of 8/16/32/64 threads and use the fastest for the rest")
+    parser.add_argument("--descending-keys", action="store_true",
+                        help="Objects use newest-first keys (<id>/<MAX_TS - ts>-...gz), so one single-key listing finds the latest")
+    parser.add_argument("--use-async", action="store_true",
+                        help="Download on a single asyncio event loop with aioboto3 instead of a thread pool")
+    parser.add_argument("--concurrency", type=int, default=256,
+                        help="Maximum number of in-flight IDs when --use-async is set")
 
     return parser.parse_args()
 
 
 def load_ids_from_csv(csv_path, id_column):
-    ids = []
-    with open(csv_path, newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            id_value = row[id_column].strip()
-            if id_value:
-                ids.append(id_value)
-    return ids
+    # keep_default_na=False keeps empty cells as "" (like csv.DictReader) instead of NaN
+    ids = pd.read_csv(csv_path, usecols=[id_column], dtype={id_column: "string"},
+                      keep_default_na=False)[id_column].str.strip()
+    return ids[ids != ""].tolist()
 
 
-def find_latest_gz_for_id(s3_client, bucket, prefix):
-    paginator = s3_client.get_paginator("list_objects_v2")
-    latest_obj = None
+def latest_gz_in(contents, latest_obj=None):
+    for obj in contents:
+        if obj["Key"].endswith(".gz"):
+            if latest_obj is None or obj["LastModified"] > latest_obj["LastModified"]:
+                latest_obj = obj
+    return latest_obj
+
 
+def find_latest_gz_for_id(s3_client, bucket, prefix, descending_keys=False):
     try:
+        # S3 lists keys in ascending order, so with newest-first keys the first one is the latest;
+        # if it is not a .gz the prefix does not follow that layout and gets a full scan below
+        if descending_keys:
+            resp = s3_client.list_objects_v2(Bucket=bucket, Prefix=prefix, MaxKeys=1)
+            latest_obj = latest_gz_in(resp.get("Contents", []))
+            if latest_obj is not None or resp.get("KeyCount", 0) == 0:
+                return latest_obj
+
+        paginator = s3_client.get_paginator("list_objects_v2")
+        latest_obj = None
+
         for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
-            contents = page.get("Contents", [])
-            for obj in contents:
-                key = obj["Key"]
-                if key.endswith(".gz"):
-                    if latest_obj is None or obj["LastModified"] > latest_obj["LastModified"]:
-                        latest_obj = obj
+            latest_obj = latest_gz_in(page.get("Contents", []), latest_obj)
 
     except ClientError:
         return None
@@ -62,51 +91,65 @@ def find_latest_gz_for_id(s3_client, bucket, prefix):
     return latest_obj
 
 
-def download_one_id(id_value, bucket, region, download_root):
-    session = boto3.Session()
-    s3 = session.client("s3", region_name=region)
+def build_s3_client(region, max_pool):
+    # One client shared by every worker thread so keep-alive connections are reused
+    config = Config(
+        max_pool_connections=max_pool,
+        retries={"mode": "adaptive", "max_attempts": 5},
+        tcp_keepalive=True,
+    )
+    return boto3.client("s3", region_name=region, config=config)
 
+
+def local_json_paths(download_root, id_value, key):
+    local_dir = Path(download_root) / id_value
+    local_dir.mkdir(parents=True, exist_ok=True)
+    json_path = (local_dir / os.path.basename(key)).with_suffix("")
+
+    # Decompress while streaming so the .gz never touches disk; write to a temp name so an
+    # interrupted download is not mistaken for a finished one on the next run
+    part_path = json_path.with_name(json_path.name + PART_SUFFIX)
+
+    return json_path, part_path
+
+
+def download_one_id(s3, id_value, bucket, download_root, descending_keys=False):
     prefix = id_value
-    latest_obj = find_latest_gz_for_id(s3, bucket, prefix)
+    latest_obj = find_latest_gz_for_id(s3, bucket, prefix, descending_keys)
 
     if latest_obj is None:
         return (id_value, False)
 
-    key = latest_obj["Key"]
-    filename = os.path.basename(key)
-    local_dir = Path(download_root) / id_value
-    local_dir.mkdir(parents=True, exist_ok=True)
-    local_path = local_dir / filename
+    json_path, part_path = local_json_paths(download_root, id_value, latest_obj["Key"])
 
-    if local_path.exists():
+    if json_path.exists():
         return (id_value, True)
 
     try:
-        s3.download_file(bucket, key, str(local_path))
+        resp = s3.get_object(Bucket=bucket, Key=latest_obj["Key"])
+        # GzipFile does not close its fileobj; close the body so a failed stream hands its
+        # connection back to the pool instead of holding it until garbage collection
+        with closing(resp["Body"]) as body, gzip.GzipFile(fileobj=body) as f_in:
+            with open(part_path, "wb") as f_out:
+                shutil.copyfileobj(f_in, f_out, STREAM_BUFFER_SIZE)
+        os.replace(part_path, json_path)
         return (id_value, True)
     except:
+        part_path.unlink(missing_ok=True)
         return (id_value, False)
 
 
-def main():
-    args = parse_args()
-
-    download_root = Path(args.download_root)
-    download_root.mkdir(parents=True, exist_ok=True)
-
-    ids = load_ids_from_csv(args.csv_path, args.id_column)
-    print(f"Loaded {len(ids)} ids.")
-
+def run_downloads(s3, ids, bucket, download_root, max_threads, descending_keys=False, desc="Downloading"):
     success_ids = []
     missing_ids = []
 
-    with ThreadPoolExecutor(max_workers=args.max_threads) as executor:
+    with ThreadPoolExecutor(max_workers=max_threads) as executor:
         futures = {
-            executor.submit(download_one_id, id_value, args.bucket_name, args.region_name, download_root): id_value
+            executor.submit(download_one_id, s3, id_value, bucket, download_root, descending_keys): id_value
             for id_value in ids
         }
 
-        for future in tqdm(as_completed(futures), total=len(futures), desc="Downloading"):
+        for future in tqdm(as_completed(futures), total=len(futures), desc=desc):
             id_value = futures[future]
             ok = future.result()
 
@@ -115,6 +158,226 @@ def main():
             else:
                 missing_ids.append(id_value)
 
+    return success_ids, missing_ids
+
+
+def is_downloaded(download_root, id_value):
+    # Key names are unknown without a listing, so any finished output from local_json_paths
+    # counts, i.e. a file other than an in-progress .part
+    local_dir = Path(download_root) / id_value
+    if not local_dir.is_dir():
+        return False
+
+    with os.scandir(local_dir) as entries:
+        return any(entry.is_file() and not entry.name.endswith(PART_SUFFIX) for entry in entries)
+
+
+def auto_tune_threads(s3, ids, bucket, download_root, default_threads, success_ids, missing_ids,
+                      descending_keys=False):
+    """Time one batch of new IDs per candidate thread count and return (best_threads, ids_left)."""
+    # IDs already on disk return almost instantly and would make any setting look fast
+    pending = [id_value for id_value in ids if not is_downloaded(download_root, id_value)]
+    warmup_size = max(AUTO_TUNE_THREADS)
+    needed = warmup_size + len(AUTO_TUNE_THREADS) * AUTO_TUNE_SAMPLE
+
+    if len(pending) < needed:
+        print(f"Auto-tune needs {needed} IDs that are not downloaded yet, found {len(pending)}; "
+              f"using {default_threads} threads.")
+        return default_threads, ids
+
+    # Untimed warm-up at the widest setting opens the pooled connections so the first timed
+    # batch does not pay TLS handshakes the others skip
+    warmup, pending = pending[:warmup_size], pending[warmup_size:]
+    ok_ids, bad_ids = run_downloads(s3, warmup, bucket, download_root, warmup_size, descending_keys,
+                                    desc="Auto-tune warm-up")
+    success_ids.extend(ok_ids)
+    missing_ids.extend(bad_ids)
+
+    timings = {}
+
+    for max_threads in AUTO_TUNE_THREADS:
+        batch, pending = pending[:AUTO_TUNE_SAMPLE], pending[AUTO_TUNE_SAMPLE:]
+
+        start = time.perf_counter()
+        ok_ids, bad_ids = run_downloads(s3, batch, bucket, download_root, max_threads, descending_keys,
+                                        desc=f"Auto-tune {max_threads} threads")
+        timings[max_threads] = (time.perf_counter() - start) / len(batch)
+
+        success_ids.extend(ok_ids)
+        missing_ids.extend(bad_ids)
+
+    print("\n----- Auto-tune: seconds per ID -----")
+    for max_threads, sec in timings.items():
+        print(f"{max_threads:>3} threads: {sec:.3f}s")
+
+    tuned = set(success_ids) | set(missing_ids)
+    ids = [id_value for id_value in ids if id_value not in tuned]
+
+    best_threads = min(timings, key=timings.get)
+    print(f"Using {best_threads} threads for the remaining {len(ids)} ids.")
+
+    return best_threads, ids
+
+
+async def find_latest_gz_for_id_async(s3_client, bucket, prefix, descending_keys=False):
+    try:
+        if descending_keys:
+            resp = await s3_client.list_objects_v2(Bucket=bucket, Prefix=prefix, MaxKeys=1)
+            latest_obj = latest_gz_in(resp.get("Contents", []))
+            if latest_obj is not None or resp.get("KeyCount", 0) == 0:
+                return latest_obj
+
+        paginator = s3_client.get_paginator("list_objects_v2")
+        latest_obj = None
+
+        async for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            latest_obj = latest_gz_in(page.get("Contents", []), latest_obj)
+
+    except ClientError:
+        return None
+
+    return latest_obj
+
+
+class GunzipWriter:
+    """Inflate gzip data fed in chunks into f_out, accepting multiple members and zero padding like GzipFile."""
+
+    def __init__(self, f_out):
+        self.f_out = f_out
+        self.inflater = None
+
+    def write(self, chunk):
+        while chunk:
+            if self.inflater is None:
+                # GzipFile skips zero bytes between and after members, so do the same
+                chunk = chunk.lstrip(b"\0")
+                if not chunk:
+                    return
+                self.inflater = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+
+            self.f_out.write(self.inflater.decompress(chunk))
+            if not self.inflater.eof:
+                return
+
+            chunk = self.inflater.unused_data
+            self.inflater = None
+
+    def finish(self):
+        if self.inflater is not None:
+            raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+
+
+async def gunzip_stream_async(body, f_out):
+    writer = GunzipWriter(f_out)
+
+    # Inflate and write in a worker thread (zlib releases the GIL) so the event loop keeps
+    # serving the other in-flight requests while this trace is decompressed
+    while chunk := await body.read(STREAM_BUFFER_SIZE):
+        await asyncio.to_thread(writer.write, chunk)
+
+    writer.finish()
+
+
+async def download_one_id_async(s3, sem, id_value, bucket, download_root, descending_keys=False):
+    async with sem:
+        latest_obj = await find_latest_gz_for_id_async(s3, bucket, id_value, descending_keys)
+
+        if latest_obj is None:
+            return (id_value, False)
+
+        json_path, part_path = local_json_paths(download_root, id_value, latest_obj["Key"])
+
+        if json_path.exists():
+            return (id_value, True)
+
+        try:
+            resp = await s3.get_object(Bucket=bucket, Key=latest_obj["Key"])
+            async with resp["Body"] as body:
+                with open(part_path, "wb") as f_out:
+                    await gunzip_stream_async(body, f_out)
+            os.replace(part_path, json_path)
+            return (id_value, True)
+        except Exception:
+            part_path.unlink(missing_ok=True)
+            return (id_value, False)
+
+
+async def run_downloads_async(ids, bucket, region, download_root, concurrency, descending_keys=False):
+    success_ids = []
+    missing_ids = []
+
+    # Optional dependency, only needed for --use-async; importing it here keeps the default
+    # threaded mode usable with any boto3 version
+    try:
+        import aioboto3
+        from aiobotocore.config import AioConfig
+    except ImportError as e:
+        raise SystemExit("--use-async requires aioboto3 (pip install aioboto3)") from e
+
+    sem = asyncio.Semaphore(concurrency)
+    config = AioConfig(max_pool_connections=concurrency,
+                       retries={"mode": "adaptive", "max_attempts": 5})
+
+    session = aioboto3.Session()
+    async with session.client("s3", region_name=region, config=config) as s3:
+        tasks = [download_one_id_async(s3, sem, id_value, bucket, download_root, descending_keys)
+                 for id_value in ids]
+
+        for task in tqdm(asyncio.as_completed(tasks), total=len(tasks), desc="Downloading"):
+            id_value, ok = await task
+
+            if ok:
+                success_ids.append(id_value)
+            else:
+                missing_ids.append(id_value)
+
+    return success_ids, missing_ids
+
+
+def download_with_threads(args, ids, download_root):
+    max_threads = args.max_threads
+    peak_threads = max(max_threads, max(AUTO_TUNE_THREADS)) if args.auto_tune else max_threads
+    max_pool = args.max_pool_connections or peak_threads
+
+    if peak_threads > max_pool:
+        # urllib3 discards connections beyond the pool size, so the extra threads keep re-handshaking
+        warnings.warn(f"{peak_threads} threads exceed --max-pool-connections={max_pool}; "
+                      f"connections will be dropped and re-opened")
+
+    s3 = build_s3_client(args.region_name, max_pool)
+
+    success_ids = []
+    missing_ids = []
+
+    if args.auto_tune and ids:
+        max_threads, ids = auto_tune_threads(s3, ids, args.bucket_name, download_root, max_threads,
+                                             success_ids, missing_ids, args.descending_keys)
+
+    ok_ids, bad_ids = run_downloads(s3, ids, args.bucket_name, download_root, max_threads,
+                                    args.descending_keys)
+    success_ids.extend(ok_ids)
+    missing_ids.extend(bad_ids)
+
+    return success_ids, missing_ids
+
+
+def main():
+    args = parse_args()
+
+    download_root = Path(args.download_root)
+    download_root.mkdir(parents=True, exist_ok=True)
+
+    ids = load_ids_from_csv(args.csv_path, args.id_column)
+    print(f"Loaded {len(ids)} ids.")
+
+    if args.use_async:
+        success_ids, missing_ids = asyncio.run(
+            run_downloads_async(ids, args.bucket_name, args.region_name, download_root, args.concurrency,
+                                args.descending_keys)
+        )
+    else:
+        success_ids, missing_ids = download_with_threads(args, ids, download_root)
+
     print("\n============================")
     print("          SUMMARY")
     print("================================")
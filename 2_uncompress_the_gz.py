@@ -1,34 +1,51 @@
-import gzip
+import os
 import shutil
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ProcessPoolExecutor
 import argparse
 
+from isal import igzip
+
+COPY_BUFFER_SIZE = 128 * 1024
+# Archives below this size are inflated in one call instead of being streamed
+SMALL_FILE_BYTES = 4 * 1024 * 1024
+# Paths handed to each worker per round trip
+MAP_CHUNKSIZE = 50
+
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Decompress all .gz files inside directory recursively")
 
     parser.add_argument("--download-root", type=str, required=True,
                         help="Root directory that contains downloaded .gz files")
-    parser.add_argument("--max-threads", type=int, default=20,
-                        help="Maximum number of parallel decompression workers")
+    parser.add_argument("--max-workers", "--max-threads", type=int, default=os.cpu_count(),
+                        help="Maximum number of parallel decompression processes")
 
     return parser.parse_args()
 
 
 def decompress_one_gz(gz_path: Path):
     json_path = gz_path.with_suffix("")
+    # Write next to the target and rename once complete, so an interrupted run never leaves a
+    # truncated .json that the exists() check would then skip on the next run
+    part_path = json_path.with_name(json_path.name + ".part")
 
     if json_path.exists():
         return True
 
     try:
-        with gzip.open(gz_path, 'rb') as f_in:
-            with open(json_path, 'wb') as f_out:
-                shutil.copyfileobj(f_in, f_out)
+        if gz_path.stat().st_size < SMALL_FILE_BYTES:
+            part_path.write_bytes(igzip.decompress(gz_path.read_bytes()))
+        else:
+            with igzip.open(gz_path, 'rb') as f_in:
+                with open(part_path, 'wb') as f_out:
+                    shutil.copyfileobj(f_in, f_out, COPY_BUFFER_SIZE)
+
+        os.replace(part_path, json_path)
         return True
 
     except Exception:
+        part_path.unlink(missing_ok=True)
         return False
 
 
@@ -36,7 +53,7 @@ def main():
     args = parse_args()
 
     download_root = Path(args.download_root)
-    max_threads = args.max_threads
+    max_workers = args.max_workers
 
     gz_files = list(download_root.rglob("*.gz"))
     print(f"Found {len(gz_files)} gz files.")
@@ -44,16 +61,11 @@ def main():
     success = 0
     failed_files = []
 
-    with ThreadPoolExecutor(max_workers=max_threads) as executor:
-        futures = {
-            executor.submit(decompress_one_gz, gz_path): gz_path
-            for gz_path in gz_files
-        }
-
-        for future in as_completed(futures):
-            gz_file = futures[future]
-            ok = future.result()
+    # Inflate is CPU-bound, so use processes rather than threads
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(decompress_one_gz, gz_files, chunksize=MAP_CHUNKSIZE)
 
+        for gz_file, ok in zip(gz_files, results):
             if ok:
                 success += 1
             else:
@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 import pandas as pd
 import argparse
@@ -22,11 +23,13 @@ def parse_args():
 def collect_ids_from_data_root(data_root: Path):
     ids = set()
 
-    for child in data_root.iterdir():
-        if child.is_dir():
-            ids.add(child.name)
-        elif child.is_file():
-            ids.add(child.stem)
+    # DirEntry caches the file type from the directory listing, so no extra stat per child
+    with os.scandir(data_root) as it:
+        for entry in it:
+            if entry.is_dir():
+                ids.add(entry.name)
+            elif entry.is_file():
+                ids.add(Path(entry.name).stem)
 
     return ids
 
@@ -43,25 +46,37 @@ def main():
     ids_on_disk = collect_ids_from_data_root(data_root)
     print(f"Found {len(ids_on_disk)} IDs in local data directory.")
 
-    df = pd.read_csv(csv_path)
-    print(f"Loaded {len(df)} rows from CSV. Columns: {list(df.columns)}")
+    # Check the header first so a missing column keeps its clear error instead of a usecols ValueError
+    csv_columns = list(pd.read_csv(csv_path, nrows=0).columns)
 
     for col in [ID_COL, AGENT_TYPE_COL, MODE_COL]:
-        if col not in df.columns:
-            raise KeyError(f"Column '{col}' not found in CSV. available columns: {list(df.columns)}")
-
-    df_sub = df[df[ID_COL].isin(ids_on_disk)].copy()
-    print(f"Matched {len(df_sub)} rows between local data and CSV IDs.")
+        if col not in csv_columns:
+            raise KeyError(f"Column '{col}' not found in CSV. available columns: {csv_columns}")
+
+    df = pd.read_csv(
+        csv_path,
+        usecols=[ID_COL, AGENT_TYPE_COL, MODE_COL],
+        dtype={ID_COL: "string", AGENT_TYPE_COL: "category", MODE_COL: "category"},
+    )
+    print(f"Loaded {len(df)} rows from CSV. Columns: {csv_columns}")
+
+    # Read-only analysis: select the two label columns through a mask instead of copying the frame
+    mask = df[ID_COL].isin(pd.Index(list(ids_on_disk)))
+    agent_types = df.loc[mask, AGENT_TYPE_COL].cat.remove_unused_categories()
+    modes = df.loc[mask, MODE_COL].cat.remove_unused_categories()
+    print(f"Matched {int(mask.sum())} rows between local data and CSV IDs.")
 
     print("\n===== Distribution: agent type =====")
-    print(df_sub[AGENT_TYPE_COL].value_counts(dropna=False))
+    print(agent_types.value_counts(dropna=False))
 
     print("\n===== Distribution: agent_execution_mode =====")
-    print(df_sub[MODE_COL].value_counts(dropna=False))
+    print(modes.value_counts(dropna=False))
 
     # This is the joint distribution
     print("\n===== Joint Distribution: agent type × agent_execution_mode =====")
-    ctab = pd.crosstab(df_sub[AGENT_TYPE_COL], df_sub[MODE_COL], dropna=False)
+    ctab = pd.crosstab(agent_types, modes, dropna=False)
+    # Categorical crosstabs put the NaN row/column first; keep it last like the object-dtype version did
+    ctab = ctab.reindex(index=sorted(ctab.index, key=pd.isna), columns=sorted(ctab.columns, key=pd.isna))
     print(ctab)
 
 
@@ -1,10 +1,21 @@
-import json
-import csv
+import os
 from pathlib import Path
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import argparse
 
+import orjson
+import pyarrow as pa
+import pyarrow.parquet as pq
+
 MAX_THREADS = 24
+# Prompts buffered before they are flushed to the output as one Parquet row group
+ROW_GROUP_SIZE = 50_000
+
+PROMPT_SCHEMA = pa.schema([
+    ("file_path", pa.string()),
+    ("prompt", pa.string()),
+    ("role", pa.string()),
+])
 
 
 def parse_args():
@@ -20,10 +31,10 @@ def parse_args():
     )
 
     parser.add_argument(
-        "--output-csv",
+        "--output-parquet",
         type=str,
         required=True,
-        help="Output CSV path for saving extracted prompts"
+        help="Output Parquet path for saving extracted prompts"
     )
 
     return parser.parse_args()
@@ -61,10 +72,11 @@ def normalize_content(content):
     return None
 
 
-def extract_prompts_from_file(file_path: Path):
+def extract_prompts_from_file(file_path: str):
     try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        # Parse the raw bytes directly; orjson skips the text decoding layer and is much faster than json
+        with open(file_path, "rb") as f:
+            data = orjson.loads(f.read())
     except Exception as e:
         print(f"[WARN] Failed to load {file_path}: {e}")
         return []
@@ -83,7 +95,7 @@ def extract_prompts_from_file(file_path: Path):
             raw_content = msg.get("content", "")
             text = normalize_content(raw_content)
             if text:
-                results.append((str(file_path), text, role))
+                results.append((file_path, text, role))
         except Exception as e:
             print(f"[WARN] Error parsing message in {file_path}: {e}")
             continue
@@ -91,38 +103,67 @@ def extract_prompts_from_file(file_path: Path):
     return results
 
 
+def write_row_group(writer, file_paths, prompts, roles):
+    if not prompts:
+        return
+
+    table = pa.table({"file_path": file_paths, "prompt": prompts, "role": roles}, schema=PROMPT_SCHEMA)
+    writer.write_table(table)
+
+    file_paths.clear()
+    prompts.clear()
+    roles.clear()
+
+
 def main():
     args = parse_args()
 
     json_root = Path(args.json_root)
-    output_csv = args.output_csv
-
-    json_files = list(json_root.rglob("*_chat_completion.json"))
+    output_parquet = args.output_parquet
+
+    # os.walk + endswith avoids building a Path and running fnmatch for every file in the tree
+    json_files = [
+        os.path.join(root, name)
+        for root, _, names in os.walk(json_root)
+        for name in names
+        if name.endswith("_chat_completion.json")
+    ]
     print(f"Found {len(json_files)} chat_completion JSON files under {json_root}")
 
-    all_rows = []
+    # Columnar buffers map straight onto a Parquet row group; they are flushed as soon as
+    # they fill up so memory stays bounded no matter how many prompts there are
+    file_paths = []
+    prompts = []
+    roles = []
+    total_prompts = 0
+
+    with pq.ParquetWriter(output_parquet, PROMPT_SCHEMA, compression="zstd", compression_level=3) as writer:
+        with ThreadPoolExecutor(max_workers=MAX_THREADS) as executor:
+            futures = {executor.submit(extract_prompts_from_file, fp): fp for fp in json_files}
 
-    with ThreadPoolExecutor(max_workers=MAX_THREADS) as executor:
-        futures = {executor.submit(extract_prompts_from_file, fp): fp for fp in json_files}
+            for i, fut in enumerate(as_completed(futures), start=1):
+                # Only this loop writes, so no lock is needed; drop the future so its rows can be freed
+                del futures[fut]
 
-        for i, fut in enumerate(as_completed(futures), start=1):
-            file_results = fut.result()
-            all_rows.extend(file_results)
+                for file_path, text, role in fut.result():
+                    file_paths.append(file_path)
+                    prompts.append(text)
+                    roles.append(role)
+                    total_prompts += 1
 
-            if i % 200 == 0:
-                print(
-                    f"Processed {i}/{len(json_files)} files, "
-                    f"collected {len(all_rows)} prompts so far"
-                )
+                if len(prompts) >= ROW_GROUP_SIZE:
+                    write_row_group(writer, file_paths, prompts, roles)
 
-    print(f"Finished. Total prompts collected: {len(all_rows)}")
+                if i % 200 == 0:
+                    print(
+                        f"Processed {i}/{len(json_files)} files, "
+                        f"collected {total_prompts} prompts so far"
+                    )
 
-    with open(output_csv, "w", newline="", encoding="utf-8") as f:
-        writer = csv.writer(f)
-        writer.writerow(["file_path", "prompt", "role"])
-        writer.writerows(all_rows)
+        write_row_group(writer, file_paths, prompts, roles)
 
-    print(f"Saved all prompts to {output_csv}")
+    print(f"Finished. Total prompts collected: {total_prompts}")
+    print(f"Saved all prompts to {output_parquet}")
 
 
 if __name__ == "__main__":
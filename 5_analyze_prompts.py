@@ -1,92 +1,175 @@
+import functools
+import os
 import re
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 import tiktoken
 from tqdm import tqdm
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
 import argparse
 
+# Shards per worker process; more than one keeps the pool balanced and the progress bar moving
+SHARDS_PER_WORKER = 8
+# Texts handed to tiktoken per encode call; bounds the token lists held in memory at once
+ENCODE_BATCH_SIZE = 1024
+
 def parse_args():
     parser = argparse.ArgumentParser(
-        description="Analyze token usage and tool calls from prompts CSV"
+        description="Analyze token usage and tool calls from the extracted prompts"
     )
 
     parser.add_argument(
+        "--prompts-path",
         "--csv-path",
         type=str,
         required=True,
-        help="Path to CSV file (with columns: file_path, prompt, role)"
+        help="Path to the Parquet (or legacy CSV) prompts file with columns: file_path, prompt, role"
+    )
+
+    parser.add_argument(
+        "--num-workers",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of processes used to analyze tool calls"
     )
 
     return parser.parse_args()
 
 
+def load_prompts(prompts_path):
+    # Step 4 writes Parquet; CSVs produced by earlier versions are still accepted
+    if str(prompts_path).endswith(".csv"):
+        return pd.read_csv(prompts_path)
+    return pd.read_parquet(prompts_path)
+
+
 # Tokenizer
+# gpt-4o-mini uses o200k_base; fetch it directly and keep one instance per process
+@functools.lru_cache(maxsize=1)
 def build_tokenizer():
-    return tiktoken.encoding_for_model("gpt-4o-mini")
+    return tiktoken.get_encoding("o200k_base")
 
 
-def count_tokens(text, enc):
-    if not isinstance(text, str):
-        return 0
-    return len(enc.encode(text))
+def count_tokens_batch(texts, enc, num_threads=None):
+    """Token count per text (0 for non-strings), encoded in parallel by tiktoken."""
+    texts = [t if isinstance(t, str) else "" for t in texts]
+    counts = np.empty(len(texts), dtype=np.uint32)
+
+    # Only one chunk of token lists is alive at a time, so memory does not grow with the corpus
+    for start in range(0, len(texts), ENCODE_BATCH_SIZE):
+        encoded = enc.encode_ordinary_batch(texts[start:start + ENCODE_BATCH_SIZE],
+                                            num_threads=num_threads or os.cpu_count())
+        counts[start:start + len(encoded)] = [len(tokens) for tokens in encoded]
+
+    return counts
 
 
 # Tool-call parsing
+# "inner" is the body of a <tool_result> block. <str-replace> blocks are consumed by their own
+# branch and leave "inner" unset, so skipping them costs no substring copy or string comparison.
+# The whitespace skip stays inside that branch: a \s* ahead of the alternation would rescan the
+# body once per leading whitespace character when the block is never closed
 TOOL_RESULT_PATTERN = re.compile(
-    r"<tool_result>(.*?)</tool_result>",
+    r"<tool_result>"
+    r"(?:\s*<str-replace>.*?|(?P<inner>.*?))"
+    r"</tool_result>",
     re.DOTALL,
 )
 
+# Searched separately on each body: folding it into TOOL_RESULT_PATTERN makes an unclosed
+# <tool_result> backtrack quadratically over every later tag
 INNER_TAG_PATTERN = re.compile(
     r"<([a-zA-Z0-9\-_]+)>"
 )
 
 
-def analyze_tool_calls(prompt, enc):
-    """Return (total_tool_tokens, first_tool_type) for a single prompt."""
+def extract_tool_results(prompt):
+    """Return (tool_result_bodies, first_tool_type) for a single prompt."""
     if not isinstance(prompt, str):
-        return 0, None
+        return [], None
 
-    total_tool_tokens = 0
+    tool_inners = []
     tool_type = None
 
-    matches = TOOL_RESULT_PATTERN.findall(prompt)
-
-    for m in matches:
-        inner = m.strip()
+    for m in TOOL_RESULT_PATTERN.finditer(prompt):
+        inner = m.group("inner")
 
         # Skip <str-replace> 
-        if inner.startswith("<str-replace>"):
+        if inner is None:
             continue
 
         tag_match = INNER_TAG_PATTERN.search(inner)
         if not tag_match:
             continue
 
-        tag = tag_match.group(1)
-
-        num_tokens = len(enc.encode(inner))
-        total_tool_tokens += num_tokens
+        tool_inners.append(inner.strip())
 
         if tool_type is None:
-            tool_type = tag
+            tool_type = tag_match.group(1)
+
+    return tool_inners, tool_type
 
-    return total_tool_tokens, tool_type
 
+def count_tool_tokens(tool_inners, enc, num_threads=None):
+    """Total tool-result tokens per prompt, encoding every body of every prompt in one batch."""
+    flat_inners = [inner for inners in tool_inners for inner in inners]
+    flat_tokens = count_tokens_batch(flat_inners, enc, num_threads)
 
-def add_token_columns(df, enc):
+    # Per-prompt sums as differences of the running total at each prompt's boundary,
+    # which also handles prompts without any tool result
+    counts = np.fromiter(map(len, tool_inners), dtype=np.int64, count=len(tool_inners))
+    ends = np.cumsum(counts)
+    running = np.zeros(len(flat_tokens) + 1, dtype=np.uint64)
+    np.cumsum(flat_tokens, out=running[1:])
+    return running[ends] - running[ends - counts]
+
+
+def _analyze_shard(prompts):
+    tool_inners, tool_types = [], []
+    for prompt in prompts:
+        inners, tool = extract_tool_results(prompt)
+        tool_inners.append(inners)
+        tool_types.append(tool)
+
+    # Shards already run in parallel processes, so tokenize each shard on a single thread
+    return count_tool_tokens(tool_inners, build_tokenizer(), num_threads=1), tool_types
+
+
+def add_token_columns(df, enc, num_workers):
     """Add num_token, num_token_from_toolcall, tool_type columns with progress bar."""
-    df["num_token"] = df["prompt"].apply(lambda x: count_tokens(x, enc))
-    df["num_token_from_toolcall"] = 0
-    df["tool_type"] = None
+    df["num_token"] = count_tokens_batch(df["prompt"].tolist(), enc)
+
+    # Collect per-shard results and assign each column once instead of a .at lookup per row
+    tool_tokens = []
+    tool_types = []
 
     print("\nAnalyzing tool calls...")
-    for idx, row in tqdm(df.iterrows(), total=len(df), desc="Processing prompts"):
-        tok, tool = analyze_tool_calls(row["prompt"], enc)
-        df.at[idx, "num_token_from_toolcall"] = tok
-        df.at[idx, "tool_type"] = tool
+    prompts = df["prompt"].values
+    shards = np.array_split(prompts, max(1, min(len(prompts), num_workers * SHARDS_PER_WORKER)))
+
+    # The initializer warms each worker's cached tokenizer before it receives its first shard
+    with ProcessPoolExecutor(max_workers=num_workers, initializer=build_tokenizer) as executor:
+        with tqdm(total=len(prompts), desc="Processing prompts") as bar:
+            for shard, (tokens, tools) in zip(shards, executor.map(_analyze_shard, shards)):
+                tool_tokens.append(tokens)
+                tool_types.extend(tools)
+                bar.update(len(shard))
+
+    df["num_token_from_toolcall"] = np.concatenate(tool_tokens).astype(np.uint32)
+    df["tool_type"] = pd.Categorical(tool_types)
+
+    return df
+
 
+def downcast_columns(df):
+    """Store low-cardinality labels as categories and token counts as the smallest unsigned ints."""
+    df["role"] = df["role"].astype("category")
+    df["tool_type"] = df["tool_type"].astype("category")
+    df["num_token"] = pd.to_numeric(df["num_token"], downcast="unsigned")
+    df["num_token_from_toolcall"] = pd.to_numeric(df["num_token_from_toolcall"], downcast="unsigned")
     return df
 
 
@@ -138,7 +221,7 @@ def tool_type_stats(df):
     print(tool_type_pct_top.to_frame("percent (%)"))
 
     avg_token_by_type = (
-        tool_df.groupby("tool_type")["num_token_from_toolcall"]
+        tool_df.groupby("tool_type", observed=True)["num_token_from_toolcall"]
         .mean()
         .sort_values(ascending=False)
     )
@@ -148,7 +231,9 @@ def tool_type_stats(df):
 
     # tool type percentage
     plt.figure(figsize=(16, 6))
-    sns.barplot(x=tool_type_pct.index, y=tool_type_pct.values)
+    # tool_type is categorical; plain string labels keep seaborn in data (sorted) order
+    # instead of alphabetical category order
+    sns.barplot(x=tool_type_pct.index.astype(str), y=tool_type_pct.values)
     plt.title("Tool type percentage (%)", fontsize=14)
     plt.ylabel("Percent (%)")
     plt.xlabel("Tool type")
@@ -158,7 +243,7 @@ def tool_type_stats(df):
 
     # average tokens per tool type
     plt.figure(figsize=(16, 6))
-    sns.barplot(x=avg_token_by_type.index, y=avg_token_by_type.values)
+    sns.barplot(x=avg_token_by_type.index.astype(str), y=avg_token_by_type.values)
     plt.title("Average tokens generated from each time of various tool-call", fontsize=14)
     plt.ylabel("Average tokens")
     plt.xlabel("Tool type")
@@ -218,7 +303,7 @@ def analyze_by_file_path(df):
     # Dominant tool type per file_path
     tool_type_by_file = (
         df[df["tool_type"].notna()]
-        .groupby(["file_path", "tool_type"])["num_token_from_toolcall"]
+        .groupby(["file_path", "tool_type"], observed=True)["num_token_from_toolcall"]
         .sum()
     )
 
@@ -234,7 +319,7 @@ def analyze_by_file_path(df):
     freq_dominant = dominant_tool_type_df["dominant_tool_type"].value_counts()
 
     plt.figure(figsize=(16, 6))
-    sns.barplot(x=freq_dominant.index, y=freq_dominant.values)
+    sns.barplot(x=freq_dominant.index.astype(str), y=freq_dominant.values)
     plt.title("Frequency of dominant tool-call types", fontsize=14)
     plt.ylabel("Number of chats")
     plt.xlabel("Tool-call type")
@@ -250,12 +335,15 @@ def analyze_by_file_path(df):
 
 def main():
     args = parse_args()
-    csv_path = args.csv_path
+    df = load_prompts(args.prompts_path)
 
-    df = pd.read_csv(csv_path)
+    # Keep the BPE file in a persistent cache so worker processes load it from disk
+    # instead of downloading it again
+    os.environ.setdefault("TIKTOKEN_CACHE_DIR", str(Path.home() / ".cache" / "tiktoken"))
     enc = build_tokenizer()
 
-    df = add_token_columns(df, enc)
+    df = add_token_columns(df, enc, args.num_workers)
+    df = downcast_columns(df)
 
     overall_stats(df)
     tool_type_stats(df)
@@ -0,0 +1,61 @@
+import importlib.util
+import time
+from pathlib import Path
+
+import pytest
+import tiktoken
+
+# Script modules start with a digit, so load them by path
+_SPEC = importlib.util.spec_from_file_location(
+    "analyze_prompts", Path(__file__).resolve().parent.parent / "5_analyze_prompts.py"
+)
+analyze_prompts = importlib.util.module_from_spec(_SPEC)
+_SPEC.loader.exec_module(analyze_prompts)
+
+
+@pytest.mark.parametrize(
+    "prompt, expected",
+    [
+        ("<tool_result> <execute-command> ok </execute-command> </tool_result>",
+         (["<execute-command> ok </execute-command>"], "execute-command")),
+        ("<tool_result>note <web-search>hit</web-search></tool_result>",
+         (["note <web-search>hit</web-search>"], "web-search")),
+        ("<tool_result> <str-replace>x</str-replace></tool_result><tool_result><a>y</a></tool_result>",
+         (["<a>y</a>"], "a")),
+        ("<tool_result>no tag here</tool_result>", ([], None)),
+        (None, ([], None)),
+    ],
+)
+def test_extract_tool_results(prompt, expected):
+    assert analyze_prompts.extract_tool_results(prompt) == expected
+
+
+@pytest.mark.parametrize(
+    "prompt",
+    [
+        # A truncated prompt: an opener with no closing tag followed by many tags
+        "<tool_result>" + "<a> text " * 16_000,
+        "<tool_result>" + " " * 100_000,
+        "<tool_result> <str-replace>" + " x" * 100_000,
+    ],
+)
+def test_extract_tool_results_unclosed_opener_is_linear(prompt):
+    start = time.perf_counter()
+    assert analyze_prompts.extract_tool_results(prompt) == ([], None)
+    assert time.perf_counter() - start < 1.0
+
+
+def test_count_tokens_batch_spans_several_encode_calls(monkeypatch):
+    # Byte-level encoding: one token per byte, no BPE download needed
+    enc = tiktoken.Encoding(
+        name="bytes",
+        pat_str=r"\S+|\s+",
+        mergeable_ranks={bytes([i]): i for i in range(256)},
+        special_tokens={},
+    )
+    monkeypatch.setattr(analyze_prompts, "ENCODE_BATCH_SIZE", 3)
+    texts = ["ab", None, "", "abc d", float("nan"), "x" * 10, "y"]
+
+    counts = analyze_prompts.count_tokens_batch(texts, enc)
+
+    assert counts.tolist() == [2, 0, 0, 5, 0, 10, 1]
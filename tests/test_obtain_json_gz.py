@@ -0,0 +1,64 @@
+import gzip
+import importlib.util
+import io
+import random
+from pathlib import Path
+
+import pytest
+
+# Script modules start with a digit, so load them by path
+_SPEC = importlib.util.spec_from_file_location(
+    "obtain_json_gz", Path(__file__).resolve().parent.parent / "1_obtain_json_gz_from_S3.py"
+)
+obtain_json_gz = importlib.util.module_from_spec(_SPEC)
+_SPEC.loader.exec_module(obtain_json_gz)
+
+_PAYLOAD = b'{"role": "user", "content": "hello"}\n' * 2000 + random.Random(0).randbytes(50_000)
+_MEMBER = gzip.compress(_PAYLOAD)
+
+
+def _gunzip_in_chunks(data, chunk_size):
+    f_out = io.BytesIO()
+    writer = obtain_json_gz.GunzipWriter(f_out)
+    for start in range(0, len(data), chunk_size):
+        writer.write(data[start:start + chunk_size])
+    writer.finish()
+    return f_out.getvalue()
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 128 * 1024])
+@pytest.mark.parametrize(
+    "data",
+    [
+        _MEMBER,
+        _MEMBER + gzip.compress(b"second member"),
+        _MEMBER + b"\0" * 100,
+        _MEMBER + b"\0" * 10 + gzip.compress(b"after padding") + b"\0" * 10,
+        gzip.compress(b""),
+        b"",
+    ],
+    ids=["single", "multi-member", "trailing-padding", "padding-between", "empty-member", "empty-input"],
+)
+def test_gunzip_writer_matches_gzip(data, chunk_size):
+    assert _gunzip_in_chunks(data, chunk_size) == gzip.decompress(data)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 128 * 1024])
+@pytest.mark.parametrize("data", [_MEMBER[:-4], _MEMBER + _MEMBER[:20]], ids=["truncated", "truncated-second"])
+def test_gunzip_writer_rejects_truncated(data, chunk_size):
+    with pytest.raises(EOFError):
+        gzip.decompress(data)
+    with pytest.raises(EOFError):
+        _gunzip_in_chunks(data, chunk_size)
+
+
+@pytest.mark.parametrize("key", ["abc/2024-01-01/trace.json.gz", "abc/trace.log.gz"])
+def test_is_downloaded_follows_local_json_paths(tmp_path, key):
+    json_path, part_path = obtain_json_gz.local_json_paths(tmp_path, "abc", key)
+    assert not obtain_json_gz.is_downloaded(tmp_path, "abc")
+
+    part_path.write_bytes(b"{")
+    assert not obtain_json_gz.is_downloaded(tmp_path, "abc")
+
+    part_path.replace(json_path)
+    assert obtain_json_gz.is_downloaded(tmp_path, "abc")